@@ -207,7 +207,7 @@ def parseAssembly(asmLines: Str) -> Tuple[List, Dict[Str, Int]]:
             machineCodes.append(handleInstruction(lineDetail, symbolTable, lineDetail['ADDR']))
     return machineCodes, symbolTable
 
-//TODO: Need to fix to_bytes for negative values.
+# TODO: Need to fix to_bytes for negative values.
 def compileAsmFile(filePath: str):
     with open(filePath, 'r', encoding='utf-8') as sourceFile:
         machineCodes, symbolTable = parseAssembly(sourceFile.read())
@@ -219,6 +219,7 @@ def compileAsmFile(filePath: str):
         binFile.write(b''.join(resultBytes))
 
 
-compileAsmFile('RecursiveFib.asm')
-with open('Bin\\RecursiveFib.obj', 'rb') as binFile:
-    print(binFile.read())
+if __name__ == '__main__':
+    compileAsmFile('RecursiveFib.asm')
+    with open('Bin\\RecursiveFib.obj', 'rb') as binFile:
+        print(binFile.read())
@@ -237,4 +237,5 @@ def speedTest():
     print(f"Speed:{int(710930/timeCost/1000)} kHz")
 
 
-speedTest()
+if __name__ == '__main__':
+    speedTest()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+from Annotations import *
+import argparse, random, time
+import numpy as np
+import numba
+
+from LC3VM_JIT import LC3VM
+from LC3Emu_Assembler import parseAssembly
+
+# Hit counts are compared by order of magnitude, one bit per bucket: 1, 2, 3, 4-7, 8-15, 16-31, 32-127, 128+
+bucketBounds = [1, 2, 3, 4, 8, 16, 32, 128]
+bucketLookup = np.array([0] + [1 << max(i for i, bound in enumerate(bucketBounds) if count >= bound) for count in range(1, 256)],
+                        dtype=np.uint8)
+
+# Characters worth trying when parsing input: NUL, newline, CR, '0', '9', just outside digits, DEL, 0xFF
+interestingChars = np.array([0, 10, 13, 48, 57, 47, 58, 127, 255], dtype=np.uint16)
+
+
+@numba.njit
+def seedRandom(seed: int):
+    np.random.seed(seed)
+
+
+@numba.njit
+def hasNewCoverage(coverage: np.ndarray, seen: np.ndarray) -> bool:
+    found = False
+    for i in range(len(coverage)):
+        if coverage[i] == 0: continue
+        bucket = bucketLookup[coverage[i]]
+        if seen[i] & bucket != bucket:
+            seen[i] |= bucket
+            found = True
+    return found
+
+
+@numba.njit
+def mutate(seed: np.ndarray, maxLength: int) -> np.ndarray:
+    data = seed.copy()
+    for _ in range(1 << np.random.randint(0, 4)):
+        strategy = np.random.randint(0, 5)
+        if strategy == 3 and len(data) < maxLength:
+            pos = np.random.randint(0, len(data) + 1)
+            data = np.concatenate((data[:pos], np.array([np.random.randint(0, 256)], dtype=np.uint16), data[pos:]))
+        elif strategy == 4 and len(data) > 1:
+            pos = np.random.randint(0, len(data))
+            data = np.concatenate((data[:pos], data[pos + 1:]))
+        elif len(data) > 0:
+            pos = np.random.randint(0, len(data))
+            if strategy == 0:
+                data[pos] ^= 1 << np.random.randint(0, 8)
+            elif strategy == 1:
+                data[pos] = np.random.randint(0, 256)
+            else:
+                data[pos] = interestingChars[np.random.randint(0, len(interestingChars))]
+    return data
+
+
+@numba.njit
+def fuzzRound(vm: LC3VM, seed: np.ndarray, seen: np.ndarray, iterations: int, maxCycles: int, maxLength: int):
+    # Mutate and run until an input reaches new coverage or the iterations run out
+    hangs = 0
+    for i in range(iterations):
+        data = mutate(seed, maxLength)
+        vm.restoreSnapshot()
+        vm.resetCoverage()
+        vm.loadInput(data)
+        if not vm.runFor(maxCycles): hangs += 1
+        if hasNewCoverage(vm.coverage, seen): return i + 1, data, hangs
+    return iterations, np.zeros(0, dtype=np.uint16), hangs
+
+
+class Fuzzer:
+    def __init__(self, vm: LC3VM, seeds: List[Str], maxCycles: Int = 100000, maxLength: Int = 64,
+                 coverageSize: Int = 1 << 14, randomSeed: Int = None):
+        # The VM must already hold the program; its current state becomes the image every run starts from
+        self.vm, self.maxCycles, self.maxLength = vm, maxCycles, maxLength
+        if not vm.coverageEnabled: vm.enableCoverage(coverageSize)
+        vm.saveSnapshot()
+        self.random = random.Random(randomSeed)
+        seedRandom(self.random.randrange(1 << 31))
+        self.seen = np.zeros(len(vm.coverage), dtype=np.uint8)
+        self.corpus: List[np.ndarray] = []
+        self.executions, self.hangs, self.elapsed = 0, 0, 0.0
+        for seed in seeds or ['\n']:
+            data = np.array([ord(c) & 0xFF for c in seed], dtype=np.uint16)
+            vm.restoreSnapshot()
+            vm.resetCoverage()
+            vm.loadInput(data)
+            if not vm.runFor(maxCycles): self.hangs += 1
+            self.executions += 1
+            hasNewCoverage(vm.coverage, self.seen)
+            self.corpus.append(data)
+
+    def run(self, executions: Int = 1000000, seconds: Float = None, roundSize: Int = 10000,
+            report: Callable[[Dict], None] = None, reportInterval: Float = 1.0) -> Dict:
+        startTime = lastReport = time.time()
+        target = self.executions + executions
+        while self.executions < target and (seconds is None or time.time() - startTime < seconds):
+            seed = self.random.choice(self.corpus)
+            execs, found, hangs = fuzzRound(self.vm, seed, self.seen, min(roundSize, target - self.executions),
+                                            self.maxCycles, self.maxLength)
+            self.executions, self.hangs = self.executions + execs, self.hangs + hangs
+            if len(found) > 0: self.corpus.append(found)
+            if report is not None and time.time() - lastReport >= reportInterval:
+                lastReport = time.time()
+                report(self.stats(self.elapsed + lastReport - startTime))
+        self.elapsed += time.time() - startTime
+        return self.stats(self.elapsed)
+
+    def stats(self, elapsed: Float) -> Dict:
+        return {'executions': self.executions, 'execsPerSecond': int(self.executions / elapsed) if elapsed > 0 else 0,
+                'corpus': len(self.corpus), 'edges': int(np.count_nonzero(self.seen)), 'hangs': self.hangs}
+
+    def corpusStrings(self) -> List[Str]:
+        return [''.join(map(chr, data)) for data in self.corpus]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Coverage-guided fuzzing of the console input of an LC-3 program.')
+    parser.add_argument('source')
+    parser.add_argument('--seed-input', action='append', default=[])
+    parser.add_argument('--executions', type=int, default=1000000)
+    parser.add_argument('--seconds', type=float, default=None)
+    parser.add_argument('--max-cycles', type=int, default=100000)
+    parser.add_argument('--max-length', type=int, default=64)
+    parser.add_argument('--random-seed', type=int, default=None)
+    args = parser.parse_args()
+    with open(args.source, 'r', encoding='utf-8') as sourceFile:
+        machineCodes, symbolTable = parseAssembly(sourceFile.read())
+    processor = LC3VM()
+    processor.loadImage(symbolTable['_PROGRAM_ENTRY_ADDR_'], np.array([i & 0xFFFF for i in machineCodes], dtype=np.uint16))
+    seeds = [seed.encode('utf-8').decode('unicode_escape') for seed in args.seed_input]
+    fuzzer = Fuzzer(processor, seeds, args.max_cycles, args.max_length, randomSeed=args.random_seed)
+    print(fuzzer.run(args.executions, args.seconds, report=print))
+    for data in fuzzer.corpusStrings():
+        print(repr(data))
@@ -4,6 +4,8 @@ import numpy as np
 import numba
 import time, random
 
+from LC3VM_Memo import SubroutineMemo, psrBit
+
 opcodeMap = {0b0001: 'ADD', 0b0101: 'AND', 0b0000: 'BR', 0b1100: 'JMP', 0b0100: 'JSR',
              0b0010: 'LD', 0b1010: 'LDI', 0b0110: 'LDR', 0b1110: 'LEA', 0b1001: 'NOT',
              0b1000: 'RTI', 0b0011: 'ST', 0b1011: 'STI', 0b0111: 'STR', 0b1111: 'TRAP'}
@@ -46,31 +48,170 @@ spec = [('memory', numba.uint16[:]),
         ('PC', numba.uint16),
         ('IR', numba.uint16),
         ('PSR', numba.uint16),
-        ('isHalted', numba.boolean)]
+        ('isHalted', numba.boolean),
+        ('inputExhausted', numba.boolean),
+        ('cycleCount', numba.int64),
+        ('inputBuffer', numba.uint16[:]),
+        ('inputPos', numba.int64),
+        ('outputBuffer', numba.uint16[:]),
+        ('outputPos', numba.int64),
+        ('cycleLimit', numba.int64),
+        ('memoEnabled', numba.boolean),
+        ('memo', SubroutineMemo.class_type.instance_type),
+        ('coverageEnabled', numba.boolean),
+        ('coverage', numba.uint8[:]),
+        ('coverageMask', numba.int64),
+        ('prevLoc', numba.int64),
+        ('hasSnapshot', numba.boolean),
+        ('snapshotMemory', numba.uint16[:]),
+        ('snapshotRegisters', numba.uint16[:]),
+        ('snapshotPC', numba.uint16),
+        ('snapshotPSR', numba.uint16),
+        ('snapshotIR', numba.uint16),
+        ('snapshotHalted', numba.boolean),
+        ('snapshotInputExhausted', numba.boolean),
+        ('snapshotCycleCount', numba.int64),
+        ('snapshotInputPos', numba.int64),
+        ('snapshotOutputPos', numba.int64),
+        ('snapshotPrevLoc', numba.int64),
+        ('dirtyFlags', numba.boolean[:]),
+        ('dirtyLog', numba.uint16[:]),
+        ('dirtyCount', numba.int64)]
+
+# Capacity of the console output buffer, further output is dropped
+outputCapacity = 65536
 
 
 @numba.experimental.jitclass(spec)
 class LC3VM:
     def __init__(self):
-        self.memory = np.array([0 for _ in range(65535)], dtype=np.uint16)
+        self.memory = np.zeros(65536, dtype=np.uint16)
         self.registers = np.array([0 for _ in range(8)], dtype=np.uint16)
         self.PC, self.IR, self.PSR = np.uint16(0x3000), np.uint16(0b0000000000000000), np.uint16(0b0000000000000000)
         self.isHalted = False
+        self.inputExhausted = False
+        self.cycleCount = 0
+        self.inputBuffer = np.zeros(0, dtype=np.uint16)
+        self.inputPos = 0
+        self.outputBuffer = np.zeros(outputCapacity, dtype=np.uint16)
+        self.outputPos = 0
+        self.cycleLimit = 0x7FFFFFFFFFFFFFFF
+        self.memoEnabled = False
+        self.memo = SubroutineMemo(0, 0, 0, 0, 0)
+        self.coverageEnabled = False
+        self.coverage = np.zeros(0, dtype=np.uint8)
+        self.coverageMask, self.prevLoc = 0, 0
+        self.hasSnapshot = False
+        self.snapshotMemory = np.zeros(0, dtype=np.uint16)
+        self.snapshotRegisters = np.zeros(8, dtype=np.uint16)
+        self.snapshotPC, self.snapshotPSR, self.snapshotIR = np.uint16(0), np.uint16(0), np.uint16(0)
+        self.snapshotHalted, self.snapshotInputExhausted = False, False
+        self.snapshotCycleCount, self.snapshotInputPos, self.snapshotOutputPos, self.snapshotPrevLoc = 0, 0, 0, 0
+        self.dirtyFlags = np.zeros(0, dtype=np.bool_)
+        self.dirtyLog = np.zeros(0, dtype=np.uint16)
+        self.dirtyCount = 0
+
+    def enableCoverage(self, size: int = 1 << 14):
+        # Edge hit counts indexed by a hash of the previous and current PC, size must be a power of two.
+        # Calls replayed by the subroutine memo do not show up here.
+        self.coverage = np.zeros(size, dtype=np.uint8)
+        self.coverageMask = size - 1
+        self.prevLoc = 0
+        self.coverageEnabled = True
+
+    def resetCoverage(self):
+        self.coverage[:] = 0
+        self.prevLoc = 0
+
+    def saveSnapshot(self):
+        # From here on every written location is logged so restoreSnapshot only copies those back.
+        # Output is kept by position only, which works because output is append-only.
+        self.snapshotMemory = self.memory.copy()
+        self.snapshotRegisters = self.registers.copy()
+        self.snapshotPC, self.snapshotPSR, self.snapshotIR = self.PC, self.PSR, self.IR
+        self.snapshotHalted, self.snapshotInputExhausted = self.isHalted, self.inputExhausted
+        self.snapshotCycleCount, self.snapshotInputPos = self.cycleCount, self.inputPos
+        self.snapshotOutputPos, self.snapshotPrevLoc = self.outputPos, self.prevLoc
+        self.dirtyFlags = np.zeros(65536, dtype=np.bool_)
+        self.dirtyLog = np.zeros(65536, dtype=np.uint16)
+        self.dirtyCount = 0
+        self.hasSnapshot = True
+
+    def restoreSnapshot(self):
+        # Without a saved snapshot there is nothing to go back to
+        if not self.hasSnapshot: return
+        for i in range(self.dirtyCount):
+            loc = self.dirtyLog[i]
+            self.memory[loc] = self.snapshotMemory[loc]
+            self.dirtyFlags[loc] = False
+        self.dirtyCount = 0
+        self.registers[:] = self.snapshotRegisters
+        self.PC, self.IR, self.PSR = self.snapshotPC, self.snapshotIR, self.snapshotPSR
+        self.isHalted, self.inputExhausted = self.snapshotHalted, self.snapshotInputExhausted
+        self.cycleCount, self.inputPos = self.snapshotCycleCount, self.snapshotInputPos
+        self.outputPos, self.prevLoc = self.snapshotOutputPos, self.snapshotPrevLoc
+        if self.memoEnabled: self.memo.clear()
+
+    def enableMemo(self, sets: int = 256, ways: int = 4, maxReads: int = 32, maxWrites: int = 128, maxDepth: int = 64):
+        # Opt-in: cache calls that turn out to be pure functions of the registers and memory they read
+        self.memo = SubroutineMemo(sets, ways, maxReads, maxWrites, maxDepth)
+        self.memoEnabled = True
+
+    def disableMemo(self):
+        self.memoEnabled = False
+        self.memo = SubroutineMemo(0, 0, 0, 0, 0)
+
+    def loadImage(self, origin: Int, words: np.ndarray):
+        for offset in range(len(words)):
+            self.writeMemory(np.uint16(origin + offset), words[offset])
+        self.PC = np.uint16(origin)
+
+    def loadInput(self, data: np.ndarray):
+        self.inputBuffer = data
+        self.inputPos = 0
+        self.inputExhausted = False
+
+    def readOutput(self) -> np.ndarray:
+        return self.outputBuffer[:self.outputPos].copy()
+
+    def readInputChar(self) -> Int:
+        # Running out of input ends the program instead of blocking
+        if self.inputPos >= len(self.inputBuffer):
+            self.isHalted = True
+            self.inputExhausted = True
+            return 0
+        char = self.inputBuffer[self.inputPos]
+        self.inputPos += 1
+        return char
+
+    def writeOutputChar(self, char: Int):
+        if self.outputPos < outputCapacity:
+            self.outputBuffer[self.outputPos] = char & 0xFF
+            self.outputPos += 1
 
     def readMemory(self, loc: Int) -> Int:
+        if self.memoEnabled: self.memo.onMemoryRead(loc, self.memory[loc])
         return self.memory[loc]
 
     def writeMemory(self, loc: Int, data: Int):
+        if self.memoEnabled: self.memo.onMemoryWrite(loc, np.uint16(data), self.memory[loc])
+        if self.hasSnapshot and not self.dirtyFlags[loc]:
+            self.dirtyFlags[loc] = True
+            self.dirtyLog[self.dirtyCount] = loc
+            self.dirtyCount += 1
         self.memory[loc] = data
 
     def readRegister(self, regIndex: Int) -> Int:
+        if self.memoEnabled: self.memo.onRegisterRead(1 << regIndex)
         return self.registers[regIndex]
 
     def writeRegister(self, regIndex: Int, data: Int):
+        if self.memoEnabled: self.memo.onRegisterWrite(1 << regIndex)
         self.registers[regIndex] = data
 
     def setcc(self):
         value = np.int16(self.readRegister(getBitField(self.IR, 11, 9)))
+        if self.memoEnabled: self.memo.onRegisterWrite(psrBit)
         self.PSR &= 0b1111111111111000
         if value < 0:
             self.PSR |= 0b0000000000000100
@@ -80,7 +221,15 @@ class LC3VM:
             self.PSR |= 0b0000000000000001
 
     def fetch(self):
-        self.IR = self.readMemory(self.PC)
+        # Instruction fetches are tracked as code, not as data reads
+        if self.memoEnabled: self.memo.onFetch(self.PC)
+        if self.coverageEnabled:
+            loc = (np.int64(self.PC) * 40503) & 0xFFFF
+            index = (loc ^ self.prevLoc) & self.coverageMask
+            # Saturate so hot edges stay in the top bucket instead of wrapping back to zero
+            if self.coverage[index] < 255: self.coverage[index] += 1
+            self.prevLoc = loc >> 1
+        self.IR = self.memory[self.PC]
         self.PC += 1
 
     def route(self):
@@ -97,8 +246,24 @@ class LC3VM:
             self.opJSR()
         elif opcode == 0b0010:
             self.opLD()
+        elif opcode == 0b1010:
+            self.opLDI()
+        elif opcode == 0b0110:
+            self.opLDR()
+        elif opcode == 0b1110:
+            self.opLEA()
+        elif opcode == 0b1001:
+            self.opNOT()
+        elif opcode == 0b0011:
+            self.opST()
+        elif opcode == 0b1011:
+            self.opSTI()
+        elif opcode == 0b0111:
+            self.opSTR()
         elif opcode == 0b1111:
-            self.isHalted = True
+            self.opTRAP()
+        elif opcode == 0b1000:
+            if self.memoEnabled: self.memo.taint()
 
     def opADD(self):
         DR, SR1, immFlag = getBitField(self.IR, 11, 9), getBitField(self.IR, 8, 6), getBitField(self.IR, 5, 5)
@@ -122,6 +287,7 @@ class LC3VM:
 
     def opBR(self):
         n, z, p = getBitField(self.IR, 11, 11), getBitField(self.IR, 10, 10), getBitField(self.IR, 9, 9)
+        if self.memoEnabled: self.memo.onRegisterRead(psrBit)
         N, Z, P = getBitField(self.PSR, 2, 2), getBitField(self.PSR, 1, 1), getBitField(self.PSR, 0, 0)
         if (n and N) or (z and Z) or (p and P):
             PCoffset9 = np.int16(getBitField(self.IR, 8, 0, True))
@@ -130,6 +296,7 @@ class LC3VM:
     def opJMP(self):
         BaseR = getBitField(self.IR, 8, 6)
         self.PC = self.readRegister(BaseR)
+        if self.memoEnabled: self.memo.onJump(self.PC, self.registers, self.PSR, self.cycleCount + 1)
 
     def opJSR(self):
         offsetFlag = getBitField(self.IR, 11, 11)
@@ -140,19 +307,113 @@ class LC3VM:
         else:
             PCoffset11 = np.int16(getBitField(self.IR, 10, 0, True))
             self.PC += PCoffset11
+        if self.memoEnabled: self.enterSubroutine()
+
+    def enterSubroutine(self):
+        index = self.memo.lookup(self.PC, self.registers, self.PSR)
+        if index >= 0 and self.cycleCount + 1 + self.memo.entryCycles[index] <= self.cycleLimit:
+            self.memo.recordHit(index)
+            self.replaySubroutine(index)
+        else:
+            self.memo.recordMiss()
+            self.memo.pushFrame(self.PC, self.registers, self.PSR, self.cycleCount + 1)
+
+    def replaySubroutine(self, index: int):
+        # Apply a cached call's effects as if it had just executed and returned
+        memo = self.memo
+        memo.mergeEntry(index)
+        for i in range(memo.entryWriteCount[index]):
+            self.writeMemory(memo.entryWriteAddr[index, i], memo.entryWriteValue[index, i])
+        mask = memo.entryWriteMask[index]
+        for r in range(8):
+            if mask & (1 << r): self.registers[r] = memo.entryOutRegs[index, r]
+        if mask & psrBit: self.PSR = (self.PSR & 0b1111111111111000) | (memo.entryOutPSR[index] & 0b111)
+        self.PC = memo.entryReturnPC[index]
+        self.cycleCount += memo.entryCycles[index]
 
     def opLD(self):
-        DR, PCoffset9 = getBitField(self.IR, 11, 9), np.int16(getBitField(self.IR, 8, 0))
-        self.writeRegister(DR, self.readMemory(self.PC + PCoffset9))
+        DR, PCoffset9 = getBitField(self.IR, 11, 9), np.int16(getBitField(self.IR, 8, 0, True))
+        self.writeRegister(DR, self.readMemory(np.uint16(self.PC + PCoffset9)))
+        self.setcc()
+
+    def opLDI(self):
+        DR, PCoffset9 = getBitField(self.IR, 11, 9), np.int16(getBitField(self.IR, 8, 0, True))
+        self.writeRegister(DR, self.readMemory(self.readMemory(np.uint16(self.PC + PCoffset9))))
+        self.setcc()
+
+    def opLDR(self):
+        DR, BaseR, offset6 = getBitField(self.IR, 11, 9), getBitField(self.IR, 8, 6), np.int16(getBitField(self.IR, 5, 0, True))
+        self.writeRegister(DR, self.readMemory(np.uint16(self.readRegister(BaseR) + offset6)))
+        self.setcc()
+
+    def opLEA(self):
+        DR, PCoffset9 = getBitField(self.IR, 11, 9), np.int16(getBitField(self.IR, 8, 0, True))
+        self.writeRegister(DR, np.uint16(self.PC + PCoffset9))
+        self.setcc()
+
+    def opNOT(self):
+        DR, SR = getBitField(self.IR, 11, 9), getBitField(self.IR, 8, 6)
+        self.writeRegister(DR, ~self.readRegister(SR))
         self.setcc()
 
+    def opST(self):
+        SR, PCoffset9 = getBitField(self.IR, 11, 9), np.int16(getBitField(self.IR, 8, 0, True))
+        self.writeMemory(np.uint16(self.PC + PCoffset9), self.readRegister(SR))
+
+    def opSTI(self):
+        SR, PCoffset9 = getBitField(self.IR, 11, 9), np.int16(getBitField(self.IR, 8, 0, True))
+        self.writeMemory(self.readMemory(np.uint16(self.PC + PCoffset9)), self.readRegister(SR))
+
+    def opSTR(self):
+        SR, BaseR, offset6 = getBitField(self.IR, 11, 9), getBitField(self.IR, 8, 6), np.int16(getBitField(self.IR, 5, 0, True))
+        self.writeMemory(np.uint16(self.readRegister(BaseR) + offset6), self.readRegister(SR))
+
+    def opTRAP(self):
+        # Service routines are emulated directly instead of through the trap vector table
+        trapvect8 = getBitField(self.IR, 7, 0)
+        if self.memoEnabled: self.memo.taint()
+        self.writeRegister(7, self.PC)
+        if trapvect8 == 0x20:
+            self.writeRegister(0, self.readInputChar())
+        elif trapvect8 == 0x21:
+            self.writeOutputChar(self.readRegister(0))
+        elif trapvect8 == 0x22:
+            loc = self.readRegister(0)
+            # Strings wrap around the address space like every other access, but are never read twice over
+            for _ in range(0x10000):
+                if self.readMemory(loc) == 0: break
+                self.writeOutputChar(self.readMemory(loc))
+                loc = np.uint16(loc + 1)
+        elif trapvect8 == 0x23:
+            char = self.readInputChar()
+            self.writeRegister(0, char)
+            if not self.isHalted: self.writeOutputChar(char)
+        elif trapvect8 == 0x24:
+            loc = self.readRegister(0)
+            for _ in range(0x10000):
+                if self.readMemory(loc) == 0: break
+                self.writeOutputChar(self.readMemory(loc))
+                if self.readMemory(loc) >> 8 == 0: break
+                self.writeOutputChar(self.readMemory(loc) >> 8)
+                loc = np.uint16(loc + 1)
+        else:
+            self.isHalted = True
+
     def cycle(self):
         self.fetch()
         self.route()
+        self.cycleCount += 1
 
     def run(self):
+        self.cycleLimit = 0x7FFFFFFFFFFFFFFF
         while not self.isHalted: self.cycle()
 
+    def runFor(self, maxCycles: int) -> bool:
+        # Run until halted or until maxCycles more instructions have executed
+        self.cycleLimit = self.cycleCount + maxCycles
+        while not self.isHalted and self.cycleCount < self.cycleLimit: self.cycle()
+        return self.isHalted
+
 
 def speedTest():
     from time import time
@@ -166,4 +427,5 @@ def speedTest():
     print(f"Speed:{int(710930 / timeCost / 1000)} kHz")
 
 
-speedTest()
+if __name__ == '__main__':
+    speedTest()
@@ -0,0 +1,314 @@
+from __future__ import annotations
+from Annotations import *
+import numpy as np
+import numba
+
+# Bit of a register mask standing for the condition codes
+psrBit = 1 << 8
+
+spec = [('sets', numba.int64),
+        ('ways', numba.int64),
+        ('maxReads', numba.int64),
+        ('maxWrites', numba.int64),
+        ('maxDepth', numba.int64),
+        # Shadow call stack, one frame per JSR that has not returned yet
+        ('depth', numba.int64),
+        ('frameEntryPC', numba.uint16[:]),
+        ('frameReturnPC', numba.uint16[:]),
+        ('frameRegs', numba.uint16[:, :]),
+        ('framePSR', numba.uint16[:]),
+        ('frameReadMask', numba.uint16[:]),
+        ('frameWriteMask', numba.uint16[:]),
+        ('frameTainted', numba.boolean[:]),
+        ('frameCodeLo', numba.int64[:]),
+        ('frameCodeHi', numba.int64[:]),
+        ('frameStartCycle', numba.int64[:]),
+        ('frameReadCount', numba.int64[:]),
+        ('frameReadAddr', numba.uint16[:, :]),
+        ('frameReadValue', numba.uint16[:, :]),
+        ('frameWriteCount', numba.int64[:]),
+        ('frameWriteAddr', numba.uint16[:, :]),
+        ('frameWriteValue', numba.uint16[:, :]),
+        # Set-associative cache of finished calls
+        ('clock', numba.int64),
+        ('entryValid', numba.boolean[:]),
+        ('entryLastUse', numba.int64[:]),
+        ('entryPC', numba.uint16[:]),
+        ('entryReturnPC', numba.uint16[:]),
+        ('entryRegs', numba.uint16[:, :]),
+        ('entryPSR', numba.uint16[:]),
+        ('entryReadMask', numba.uint16[:]),
+        ('entryWriteMask', numba.uint16[:]),
+        ('entryOutRegs', numba.uint16[:, :]),
+        ('entryOutPSR', numba.uint16[:]),
+        ('entryCodeLo', numba.int64[:]),
+        ('entryCodeHi', numba.int64[:]),
+        ('entryCycles', numba.int64[:]),
+        ('entryReadCount', numba.int64[:]),
+        ('entryReadAddr', numba.uint16[:, :]),
+        ('entryReadValue', numba.uint16[:, :]),
+        ('entryWriteCount', numba.int64[:]),
+        ('entryWriteAddr', numba.uint16[:, :]),
+        ('entryWriteValue', numba.uint16[:, :]),
+        # Last register mask seen for each subroutine, used to hash lookups
+        ('subroutineMask', numba.uint16[:]),
+        # Number of cache entries depending on each memory location
+        ('watchCount', numba.int32[:]),
+        ('hits', numba.int64),
+        ('misses', numba.int64),
+        ('inserts', numba.int64),
+        ('evictions', numba.int64),
+        ('invalidations', numba.int64)]
+
+
+@numba.experimental.jitclass(spec)
+class SubroutineMemo:
+    def __init__(self, sets: int, ways: int, maxReads: int, maxWrites: int, maxDepth: int):
+        self.sets, self.ways, self.maxReads, self.maxWrites, self.maxDepth = sets, ways, maxReads, maxWrites, maxDepth
+        self.depth = 0
+        self.frameEntryPC = np.zeros(maxDepth, dtype=np.uint16)
+        self.frameReturnPC = np.zeros(maxDepth, dtype=np.uint16)
+        self.frameRegs = np.zeros((maxDepth, 8), dtype=np.uint16)
+        self.framePSR = np.zeros(maxDepth, dtype=np.uint16)
+        self.frameReadMask = np.zeros(maxDepth, dtype=np.uint16)
+        self.frameWriteMask = np.zeros(maxDepth, dtype=np.uint16)
+        self.frameTainted = np.zeros(maxDepth, dtype=np.bool_)
+        self.frameCodeLo = np.zeros(maxDepth, dtype=np.int64)
+        self.frameCodeHi = np.zeros(maxDepth, dtype=np.int64)
+        self.frameStartCycle = np.zeros(maxDepth, dtype=np.int64)
+        self.frameReadCount = np.zeros(maxDepth, dtype=np.int64)
+        self.frameReadAddr = np.zeros((maxDepth, maxReads), dtype=np.uint16)
+        self.frameReadValue = np.zeros((maxDepth, maxReads), dtype=np.uint16)
+        self.frameWriteCount = np.zeros(maxDepth, dtype=np.int64)
+        self.frameWriteAddr = np.zeros((maxDepth, maxWrites), dtype=np.uint16)
+        self.frameWriteValue = np.zeros((maxDepth, maxWrites), dtype=np.uint16)
+        entries = sets * ways
+        self.clock = 0
+        self.entryValid = np.zeros(entries, dtype=np.bool_)
+        self.entryLastUse = np.zeros(entries, dtype=np.int64)
+        self.entryPC = np.zeros(entries, dtype=np.uint16)
+        self.entryReturnPC = np.zeros(entries, dtype=np.uint16)
+        self.entryRegs = np.zeros((entries, 8), dtype=np.uint16)
+        self.entryPSR = np.zeros(entries, dtype=np.uint16)
+        self.entryReadMask = np.zeros(entries, dtype=np.uint16)
+        self.entryWriteMask = np.zeros(entries, dtype=np.uint16)
+        self.entryOutRegs = np.zeros((entries, 8), dtype=np.uint16)
+        self.entryOutPSR = np.zeros(entries, dtype=np.uint16)
+        self.entryCodeLo = np.zeros(entries, dtype=np.int64)
+        self.entryCodeHi = np.zeros(entries, dtype=np.int64)
+        self.entryCycles = np.zeros(entries, dtype=np.int64)
+        self.entryReadCount = np.zeros(entries, dtype=np.int64)
+        self.entryReadAddr = np.zeros((entries, maxReads), dtype=np.uint16)
+        self.entryReadValue = np.zeros((entries, maxReads), dtype=np.uint16)
+        self.entryWriteCount = np.zeros(entries, dtype=np.int64)
+        self.entryWriteAddr = np.zeros((entries, maxWrites), dtype=np.uint16)
+        self.entryWriteValue = np.zeros((entries, maxWrites), dtype=np.uint16)
+        self.subroutineMask = np.zeros(65536 if entries > 0 else 0, dtype=np.uint16)
+        self.watchCount = np.zeros(65536 if entries > 0 else 0, dtype=np.int32)
+        self.hits, self.misses, self.inserts, self.evictions, self.invalidations = 0, 0, 0, 0, 0
+
+    def hashKey(self, entryPC: int, registers: np.ndarray, PSR: int, mask: int) -> int:
+        key = np.int64(entryPC)
+        for r in range(8):
+            if mask & (1 << r): key = (key * 31 + np.int64(registers[r])) % 2147483647
+        if mask & psrBit: key = (key * 31 + np.int64(PSR & 0b111)) % 2147483647
+        return key % self.sets
+
+    def matches(self, index: int, entryPC: int, registers: np.ndarray, PSR: int) -> bool:
+        if not self.entryValid[index] or self.entryPC[index] != entryPC: return False
+        mask = self.entryReadMask[index]
+        for r in range(8):
+            if mask & (1 << r) and self.entryRegs[index, r] != registers[r]: return False
+        if mask & psrBit and (self.entryPSR[index] & 0b111) != (PSR & 0b111): return False
+        return True
+
+    def lookup(self, entryPC: int, registers: np.ndarray, PSR: int) -> int:
+        # Returns the index of a cached call matching the current inputs, or -1; stats are left to the caller
+        base = self.hashKey(entryPC, registers, PSR, self.subroutineMask[entryPC]) * self.ways
+        for index in range(base, base + self.ways):
+            if self.matches(index, entryPC, registers, PSR): return index
+        return -1
+
+    def recordHit(self, index: int):
+        self.hits += 1
+        self.clock += 1
+        self.entryLastUse[index] = self.clock
+
+    def recordMiss(self):
+        self.misses += 1
+
+    def setWatch(self, index: int, delta: int):
+        for loc in range(self.entryCodeLo[index], self.entryCodeHi[index] + 1):
+            self.watchCount[loc] += delta
+        for i in range(self.entryReadCount[index]):
+            self.watchCount[self.entryReadAddr[index, i]] += delta
+
+    def dependsOn(self, index: int, loc: int) -> bool:
+        if self.entryCodeLo[index] <= loc <= self.entryCodeHi[index]: return True
+        for i in range(self.entryReadCount[index]):
+            if self.entryReadAddr[index, i] == loc: return True
+        return False
+
+    def invalidate(self, index: int):
+        self.setWatch(index, -1)
+        self.entryValid[index] = False
+
+    def clear(self):
+        for index in range(self.sets * self.ways):
+            if self.entryValid[index]: self.invalidate(index)
+        self.depth = 0
+
+    def taint(self):
+        # The active calls stopped being functions of their tracked inputs
+        for i in range(self.depth):
+            self.frameTainted[i] = True
+
+    def pushFrame(self, entryPC: int, registers: np.ndarray, PSR: int, startCycle: int):
+        # Calls nested deeper than the shadow stack are not tracked, and neither are their callers
+        if self.depth == self.maxDepth:
+            self.depth = 0
+            return
+        top = self.depth
+        self.frameEntryPC[top], self.frameReturnPC[top] = entryPC, registers[7]
+        self.frameRegs[top, :] = registers
+        self.framePSR[top] = PSR
+        self.frameReadMask[top], self.frameWriteMask[top] = 0, 0
+        self.frameTainted[top] = False
+        self.frameCodeLo[top], self.frameCodeHi[top] = entryPC, entryPC
+        self.frameStartCycle[top] = startCycle
+        self.frameReadCount[top], self.frameWriteCount[top] = 0, 0
+        self.depth += 1
+
+    def onFetch(self, loc: int):
+        if self.depth == 0: return
+        top = self.depth - 1
+        self.frameCodeLo[top] = min(self.frameCodeLo[top], loc)
+        self.frameCodeHi[top] = max(self.frameCodeHi[top], loc)
+
+    def onRegisterRead(self, mask: int):
+        if self.depth == 0: return
+        top = self.depth - 1
+        self.frameReadMask[top] |= mask & ~self.frameWriteMask[top]
+
+    def onRegisterWrite(self, mask: int):
+        if self.depth == 0: return
+        self.frameWriteMask[self.depth - 1] |= mask
+
+    def recordRead(self, top: int, loc: int, value: int):
+        for i in range(self.frameWriteCount[top]):
+            if self.frameWriteAddr[top, i] == loc: return
+        for i in range(self.frameReadCount[top]):
+            if self.frameReadAddr[top, i] == loc: return
+        if self.frameReadCount[top] == self.maxReads:
+            self.frameTainted[top] = True
+            return
+        self.frameReadAddr[top, self.frameReadCount[top]] = loc
+        self.frameReadValue[top, self.frameReadCount[top]] = value
+        self.frameReadCount[top] += 1
+
+    def recordWrite(self, top: int, loc: int, value: int):
+        for i in range(self.frameWriteCount[top]):
+            if self.frameWriteAddr[top, i] == loc:
+                self.frameWriteValue[top, i] = value
+                return
+        if self.frameWriteCount[top] == self.maxWrites:
+            self.frameTainted[top] = True
+            return
+        self.frameWriteAddr[top, self.frameWriteCount[top]] = loc
+        self.frameWriteValue[top, self.frameWriteCount[top]] = value
+        self.frameWriteCount[top] += 1
+
+    def onMemoryRead(self, loc: int, value: int):
+        if self.depth > 0: self.recordRead(self.depth - 1, loc, value)
+
+    def onMemoryWrite(self, loc: int, data: int, old: int):
+        if self.depth > 0: self.recordWrite(self.depth - 1, loc, data)
+        # Drop every cached call whose code or inputs live at the changed location
+        if data != old and self.watchCount[loc] > 0:
+            for index in range(self.sets * self.ways):
+                if self.entryValid[index] and self.dependsOn(index, loc):
+                    self.invalidate(index)
+                    self.invalidations += 1
+
+    def onJump(self, target: int, registers: np.ndarray, PSR: int, endCycle: int):
+        if self.depth == 0: return
+        if target == self.frameReturnPC[self.depth - 1]:
+            self.popFrame(registers, PSR, endCycle)
+        else:
+            self.taint()
+
+    def mergeIntoParent(self, readMask: int, writeMask: int, codeLo: int, codeHi: int):
+        parent = self.depth - 1
+        self.frameReadMask[parent] |= readMask & ~self.frameWriteMask[parent]
+        self.frameWriteMask[parent] |= writeMask
+        self.frameCodeLo[parent] = min(self.frameCodeLo[parent], codeLo)
+        self.frameCodeHi[parent] = max(self.frameCodeHi[parent], codeHi)
+
+    def popFrame(self, registers: np.ndarray, PSR: int, endCycle: int):
+        self.depth -= 1
+        top = self.depth
+        if not self.frameTainted[top]: self.insert(top, registers, PSR, endCycle)
+        if self.depth == 0: return
+        # The finished call's effects become part of its caller's
+        parent = self.depth - 1
+        self.mergeIntoParent(self.frameReadMask[top], self.frameWriteMask[top], self.frameCodeLo[top], self.frameCodeHi[top])
+        if self.frameTainted[top]: self.frameTainted[parent] = True
+        for i in range(self.frameReadCount[top]):
+            self.recordRead(parent, self.frameReadAddr[top, i], self.frameReadValue[top, i])
+        for i in range(self.frameWriteCount[top]):
+            self.recordWrite(parent, self.frameWriteAddr[top, i], self.frameWriteValue[top, i])
+
+    def mergeEntry(self, index: int):
+        # A replayed call counts as having run inside the active frame; its writes arrive through onMemoryWrite
+        if self.depth == 0: return
+        self.mergeIntoParent(self.entryReadMask[index], self.entryWriteMask[index], self.entryCodeLo[index], self.entryCodeHi[index])
+        for i in range(self.entryReadCount[index]):
+            self.recordRead(self.depth - 1, self.entryReadAddr[index, i], self.entryReadValue[index, i])
+
+    def insert(self, top: int, registers: np.ndarray, PSR: int, endCycle: int):
+        # Calls that rewrote their own code cannot be replayed
+        for i in range(self.frameWriteCount[top]):
+            if self.frameCodeLo[top] <= self.frameWriteAddr[top, i] <= self.frameCodeHi[top]: return
+        # Nor can calls that changed a word they read, since their own write never invalidates them
+        for i in range(self.frameReadCount[top]):
+            for j in range(self.frameWriteCount[top]):
+                if self.frameReadAddr[top, i] == self.frameWriteAddr[top, j] and \
+                        self.frameReadValue[top, i] != self.frameWriteValue[top, j]: return
+        entryPC, mask = self.frameEntryPC[top], self.frameReadMask[top]
+        self.subroutineMask[entryPC] = mask
+        base = self.hashKey(entryPC, self.frameRegs[top], self.framePSR[top], mask) * self.ways
+        # An entry for the same inputs is replaced in place, e.g. after a replay was refused by the cycle limit
+        index = -1
+        for way in range(base, base + self.ways):
+            if self.matches(way, entryPC, self.frameRegs[top], self.framePSR[top]):
+                index = way
+                break
+        if index >= 0:
+            self.invalidate(index)
+        else:
+            index = base
+            for way in range(base, base + self.ways):
+                if not self.entryValid[way]:
+                    index = way
+                    break
+                if self.entryLastUse[way] < self.entryLastUse[index]: index = way
+            if self.entryValid[index]:
+                self.invalidate(index)
+                self.evictions += 1
+        self.clock += 1
+        self.entryValid[index], self.entryLastUse[index] = True, self.clock
+        self.entryPC[index], self.entryReturnPC[index] = entryPC, self.frameReturnPC[top]
+        self.entryRegs[index, :] = self.frameRegs[top]
+        self.entryPSR[index] = self.framePSR[top]
+        self.entryReadMask[index], self.entryWriteMask[index] = mask, self.frameWriteMask[top]
+        self.entryOutRegs[index, :] = registers
+        self.entryOutPSR[index] = PSR
+        self.entryCodeLo[index], self.entryCodeHi[index] = self.frameCodeLo[top], self.frameCodeHi[top]
+        self.entryCycles[index] = endCycle - self.frameStartCycle[top]
+        self.entryReadCount[index], self.entryWriteCount[index] = self.frameReadCount[top], self.frameWriteCount[top]
+        self.entryReadAddr[index, :] = self.frameReadAddr[top]
+        self.entryReadValue[index, :] = self.frameReadValue[top]
+        self.entryWriteAddr[index, :] = self.frameWriteAddr[top]
+        self.entryWriteValue[index, :] = self.frameWriteValue[top]
+        self.setWatch(index, 1)
+        self.inserts += 1
@@ -0,0 +1,221 @@
+from __future__ import annotations
+from Annotations import *
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from threading import Event, Lock, Thread
+import argparse, json
+import numpy as np
+
+from LC3VM_JIT import LC3VM
+from LC3Emu_Assembler import parseAssembly
+
+# Small program touching every VM entry point used by runJob, so numba compiles them in the worker up front
+warmUpSource = '''
+        .ORIG x3000
+        LEA R0,text
+        PUTS
+        GETC
+        OUT
+        HALT
+text    .STRINGZ "ok"
+        .END
+'''
+
+
+def warmUp():
+    machineCodes, symbolTable = parseAssembly(warmUpSource)
+    for memoize in (False, True):
+        vm = LC3VM()
+        if memoize: vm.enableMemo()
+        vm.loadImage(symbolTable['_PROGRAM_ENTRY_ADDR_'], np.array(machineCodes, dtype=np.uint16))
+        vm.loadInput(np.array([ord('!')], dtype=np.uint16))
+        vm.runFor(100)
+        vm.readOutput()
+
+
+def ping(index: Int) -> Int:
+    return index
+
+
+def isWord(value: Any) -> Bool:
+    # JSON booleans decode to bool, which is a subclass of int
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def runJob(job: Dict, maxCycles: Int) -> Dict:
+    # Jobs carry either assembly source or an object image whose first word is the origin
+    if 'source' in job:
+        machineCodes, symbolTable = parseAssembly(job['source'])
+        origin = symbolTable['_PROGRAM_ENTRY_ADDR_']
+    else:
+        origin, machineCodes = job['image'][0], job['image'][1:]
+        if not all(isWord(i) for i in job['image']):
+            raise ValueError('image words must be integers')
+    # The VM does no bounds checking, so images must fit in memory as given
+    if not isWord(origin) or not 0 <= origin <= 0xFFFF or origin + len(machineCodes) > 0x10000:
+        raise ValueError(f'image at origin {origin} with {len(machineCodes)} words does not fit in memory')
+    words = [i & 0xFFFF for i in machineCodes]
+    vm = LC3VM()
+    if job.get('memoize', False): vm.enableMemo()
+    vm.loadImage(origin, np.array(words, dtype=np.uint16))
+    vm.loadInput(np.array([ord(c) & 0xFFFF for c in job.get('stdin', '')], dtype=np.uint16))
+    halted = vm.runFor(min(int(job.get('maxCycles', maxCycles)), maxCycles))
+    return {'origin': origin, 'words': words, 'output': ''.join(map(chr, vm.readOutput())),
+            'registers': [int(i) for i in vm.registers], 'PC': int(vm.PC), 'PSR': int(vm.PSR),
+            'cycles': int(vm.cycleCount), 'halted': bool(halted), 'inputExhausted': bool(vm.inputExhausted),
+            'memoHits': int(vm.memo.hits)}
+
+
+def runBatch(jobs: List[Dict], maxCycles: Int) -> List[Dict]:
+    results = []
+    for job in jobs:
+        try:
+            results.append(runJob(job, maxCycles))
+        except Exception as e:
+            results.append({'error': f'{type(e).__name__}: {e}'})
+    return results
+
+
+class LC3Service:
+    def __init__(self, workers: Int = 4, maxPending: Int = 256, maxCycles: Int = 10000000, batchSize: Int = 16,
+                 maxBodySize: Int = 16 << 20, autoStart: Bool = True):
+        self.workers, self.maxPending, self.maxCycles, self.batchSize = workers, maxPending, maxCycles, batchSize
+        self.maxBodySize = maxBodySize
+        # Number of jobs accepted but not yet finished, used for backpressure
+        self.pending, self.pendingLock = 0, Lock()
+        # The pool is None while it is being built; requests get 503 until it is ready
+        self.pool, self.poolLock, self.poolBuilding, self.poolReady = None, Lock(), False, Event()
+        if autoStart:
+            self.startPool()
+            # Wait for every worker to start and finish warming up before serving
+            self.poolReady.wait()
+
+    def startPool(self):
+        with self.poolLock:
+            if self.poolBuilding: return
+            self.poolBuilding = True
+            self.poolReady.clear()
+        Thread(target=self.buildPool, daemon=True).start()
+
+    def buildPool(self):
+        pool = None
+        try:
+            pool = ProcessPoolExecutor(self.workers, mp_context=get_context('spawn'), initializer=warmUp)
+            list(pool.map(ping, range(self.workers)))
+        except Exception as e:
+            # Left as None, so the next request starts another attempt
+            print(f'Failed to start worker pool: {type(e).__name__}: {e}')
+            if pool is not None: pool.shutdown(wait=False)
+            pool = None
+        with self.poolLock:
+            self.pool, self.poolBuilding = pool, False
+            self.poolReady.set()
+
+    def replacePool(self, brokenPool: ProcessPoolExecutor):
+        # Only the first request to notice a dead worker starts the rebuild
+        with self.poolLock:
+            if self.pool is not brokenPool: return
+            self.pool = None
+        brokenPool.shutdown(wait=False)
+        self.startPool()
+
+    def submit(self, jobs: List[Dict]) -> Tuple[Int, Dict]:
+        # Returns the HTTP status code and body for a batch of jobs
+        if len(jobs) > self.maxPending:
+            return 413, {'error': f'batch of {len(jobs)} jobs exceeds the limit of {self.maxPending}'}
+        pool = self.pool
+        if pool is None:
+            self.startPool()
+            return 503, {'error': 'worker pool is starting'}
+        with self.pendingLock:
+            if self.pending + len(jobs) > self.maxPending:
+                return 503, {'error': 'too many pending jobs'}
+            self.pending += len(jobs)
+        try:
+            batches = [jobs[i:i + self.batchSize] for i in range(0, len(jobs), self.batchSize)]
+            futures = [pool.submit(runBatch, batch, self.maxCycles) for batch in batches]
+            return 200, {'results': [result for future in futures for result in future.result()]}
+        except BrokenProcessPool:
+            self.replacePool(pool)
+            return 500, {'error': 'worker process died, the batch was not completed'}
+        except RuntimeError:
+            # Another request shut this pool down after finding it broken
+            return 503, {'error': 'worker pool is restarting'}
+        finally:
+            with self.pendingLock:
+                self.pending -= len(jobs)
+
+    def status(self) -> Dict:
+        return {'workers': self.workers, 'ready': self.pool is not None, 'pending': self.pending,
+                'maxPending': self.maxPending, 'maxCycles': self.maxCycles, 'batchSize': self.batchSize}
+
+    def shutdown(self):
+        if self.pool is not None: self.pool.shutdown()
+
+
+class LC3RequestHandler(BaseHTTPRequestHandler):
+    service: LC3Service = None
+
+    def sendJSON(self, code: Int, body: Any, headers: Dict[Str, Str] = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/status':
+            return self.sendJSON(404, {'error': 'not found'})
+        self.sendJSON(200, self.service.status())
+
+    def do_POST(self):
+        if self.path != '/run':
+            return self.sendJSON(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            return self.sendJSON(400, {'error': 'invalid Content-Length'})
+        if length < 0:
+            return self.sendJSON(400, {'error': 'invalid Content-Length'})
+        if length > self.service.maxBodySize:
+            return self.sendJSON(413, {'error': f'request body exceeds {self.service.maxBodySize} bytes'})
+        try:
+            request = json.loads(self.rfile.read(length))
+            # A single job object is accepted as a batch of one
+            jobs = request['jobs'] if 'jobs' in request else [request]
+            assert isinstance(jobs, list) and all(isinstance(job, dict) for job in jobs)
+        except (ValueError, KeyError, TypeError, AssertionError):
+            return self.sendJSON(400, {'error': 'malformed request'})
+        code, body = self.service.submit(jobs)
+        self.sendJSON(code, body, {'Retry-After': '1'} if code == 503 else None)
+
+
+def serve(host: Str, port: Int, service: LC3Service):
+    LC3RequestHandler.service = service
+    server = ThreadingHTTPServer((host, port), LC3RequestHandler)
+    print(f'Serving on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local LC-3 assemble-and-run service.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8033)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-pending', type=int, default=256)
+    parser.add_argument('--max-cycles', type=int, default=10000000)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-body-size', type=int, default=16 << 20)
+    args = parser.parse_args()
+    serve(args.host, args.port, LC3Service(args.workers, args.max_pending, args.max_cycles, args.batch_size, args.max_body_size))
@@ -0,0 +1,122 @@
+import os
+import numpy as np
+
+from LC3VM_JIT import LC3VM
+from LC3VM_Fuzz import Fuzzer, hasNewCoverage
+from LC3Emu_Assembler import parseAssembly
+
+fibPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'RecursiveFib.asm')
+
+# Writes memory through ST, STI and STR, then prints two characters and halts
+writerSource = '''
+        .ORIG x3000
+        LD R1,VAL
+        ST R1,SLOT1
+        STI R1,PTR
+        LEA R2,SLOT3
+        STR R1,R2,#0
+        ADD R3,R1,#-2
+        GETC
+        OUT
+        GETC
+        OUT
+        HALT
+VAL     .FILL x41
+SLOT1   .FILL #0
+SLOT2   .FILL #0
+SLOT3   .FILL #0
+PTR     .FILL SLOT2
+        .END
+'''
+
+
+def loadProgram(source, coverageSize=0):
+    machineCodes, symbolTable = parseAssembly(source)
+    vm = LC3VM()
+    if coverageSize: vm.enableCoverage(coverageSize)
+    vm.loadImage(symbolTable['_PROGRAM_ENTRY_ADDR_'], np.array([i & 0xFFFF for i in machineCodes], dtype=np.uint16))
+    return vm, symbolTable
+
+
+def test_restore_undoes_every_store():
+    vm, symbolTable = loadProgram(writerSource)
+    vm.saveSnapshot()
+    memory, registers, PC, PSR = vm.memory.copy(), vm.registers.copy(), vm.PC, vm.PSR
+    vm.loadInput(np.array([ord('x'), ord('y')], dtype=np.uint16))
+    vm.runFor(1000)
+    assert vm.isHalted
+    assert all(vm.memory[symbolTable[label]] == 0x41 for label in ('SLOT1', 'SLOT2', 'SLOT3'))
+    vm.restoreSnapshot()
+    assert (vm.memory == memory).all() and (vm.registers == registers).all()
+    assert (vm.PC, vm.PSR, vm.cycleCount, vm.isHalted) == (PC, PSR, 0, False)
+    assert len(vm.readOutput()) == 0
+
+
+def test_restored_run_matches_fresh_run():
+    fresh, _ = loadProgram(writerSource)
+    fresh.loadInput(np.array([ord('x'), ord('y')], dtype=np.uint16))
+    fresh.runFor(1000)
+    vm, _ = loadProgram(writerSource)
+    vm.saveSnapshot()
+    for data in ('ab', 'x', 'xy'):
+        vm.restoreSnapshot()
+        vm.loadInput(np.array([ord(c) for c in data], dtype=np.uint16))
+        vm.runFor(1000)
+    assert (vm.memory == fresh.memory).all() and (vm.registers == fresh.registers).all()
+    assert (vm.PC, vm.PSR, vm.cycleCount) == (fresh.PC, fresh.PSR, fresh.cycleCount)
+    assert (vm.readOutput() == fresh.readOutput()).all()
+
+
+def test_snapshot_taken_mid_run_keeps_earlier_state():
+    vm, _ = loadProgram(writerSource)
+    vm.loadInput(np.array([ord('x'), ord('y')], dtype=np.uint16))
+    vm.runFor(8)
+    assert list(vm.readOutput()) == [ord('x')]
+    vm.saveSnapshot()
+    registers, PC, cycleCount = vm.registers.copy(), vm.PC, vm.cycleCount
+    vm.runFor(1000)
+    assert list(vm.readOutput()) == [ord('x'), ord('y')]
+    vm.restoreSnapshot()
+    assert list(vm.readOutput()) == [ord('x')]
+    assert (vm.registers == registers).all() and (vm.PC, vm.cycleCount) == (PC, cycleCount)
+
+
+def test_restore_without_snapshot_does_nothing():
+    vm, _ = loadProgram(writerSource)
+    vm.runFor(3)
+    registers, PC, cycleCount = vm.registers.copy(), vm.PC, vm.cycleCount
+    vm.restoreSnapshot()
+    assert (vm.registers == registers).all() and (vm.PC, vm.cycleCount) == (PC, cycleCount)
+
+
+def test_hot_edge_saturates():
+    vm, _ = loadProgram('''
+        .ORIG x3000
+        AND R0,R0,#0
+LOOP    BRnzp LOOP
+        .END
+''', 1 << 14)
+    vm.runFor(1000)
+    assert vm.coverage.max() == 255
+
+
+def test_new_coverage_is_judged_by_bucket():
+    coverage, seen = np.zeros(8, dtype=np.uint8), np.zeros(8, dtype=np.uint8)
+    coverage[:] = [0, 1, 2, 3, 5, 40, 200, 255]
+    assert hasNewCoverage(coverage, seen)
+    assert not hasNewCoverage(coverage, seen)
+    # Counts within the same bucket are not new, moving to another bucket is
+    coverage[4], coverage[7] = 7, 128
+    assert not hasNewCoverage(coverage, seen)
+    coverage[1] = 2
+    assert hasNewCoverage(coverage, seen)
+
+
+def test_fuzzer_grows_coverage():
+    with open(fibPath, 'r', encoding='utf-8') as sourceFile:
+        vm, _ = loadProgram(sourceFile.read())
+    fuzzer = Fuzzer(vm, ['10\n'], maxCycles=5000, randomSeed=1)
+    before = fuzzer.stats(1.0)
+    stats = fuzzer.run(3000, roundSize=500)
+    assert stats['executions'] == before['executions'] + 3000
+    assert stats['edges'] > before['edges'] and stats['corpus'] > before['corpus']
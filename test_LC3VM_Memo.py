@@ -0,0 +1,204 @@
+import os
+import numpy as np
+
+from LC3VM_JIT import LC3VM
+from LC3Emu_Assembler import parseAssembly
+
+
+fibPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'RecursiveFib.asm')
+
+
+def runProgram(source, stdin='', memoArgs=None, maxCycles=1000000):
+    machineCodes, symbolTable = parseAssembly(source)
+    vm = LC3VM()
+    if memoArgs is not None: vm.enableMemo(*memoArgs)
+    vm.loadImage(symbolTable['_PROGRAM_ENTRY_ADDR_'], np.array([i & 0xFFFF for i in machineCodes], dtype=np.uint16))
+    vm.loadInput(np.array([ord(c) for c in stdin], dtype=np.uint16))
+    vm.runFor(maxCycles)
+    return vm
+
+
+def assertSameRun(source, stdin='', memoArgs=(256, 4, 32, 128, 64)):
+    # Memoization must leave no trace in guest-visible state
+    plain, memoized = runProgram(source, stdin), runProgram(source, stdin, memoArgs)
+    assert plain.isHalted
+    assert (plain.memory == memoized.memory).all()
+    assert (plain.registers == memoized.registers).all()
+    assert (plain.PC, plain.PSR, plain.cycleCount) == (memoized.PC, memoized.PSR, memoized.cycleCount)
+    assert (plain.readOutput() == memoized.readOutput()).all()
+    return memoized.memo
+
+
+def test_pure_call_in_loop_is_replayed():
+    memo = assertSameRun('''
+        .ORIG x3000
+        AND R4,R4,#0
+        ADD R4,R4,#5
+LOOP    JSR DOUBLE
+        ADD R4,R4,#-1
+        BRp LOOP
+        HALT
+DOUBLE  LD R1,VAL
+        ADD R1,R1,R1
+        RET
+VAL     .FILL #7
+        .END
+''')
+    assert memo.hits == 4
+
+
+def test_read_modify_write_call_is_not_replayed():
+    memo = assertSameRun('''
+        .ORIG x3000
+        AND R4,R4,#0
+        ADD R4,R4,#5
+LOOP    JSR INC
+        ADD R4,R4,#-1
+        BRp LOOP
+        HALT
+INC     LD R0,CNT
+        ADD R0,R0,#1
+        ST R0,CNT
+        RET
+CNT     .FILL #0
+        .END
+''')
+    assert memo.hits == 0
+
+
+def test_memory_write_invalidates_entries():
+    memo = assertSameRun('''
+        .ORIG x3000
+        AND R4,R4,#0
+        ADD R4,R4,#6
+LOOP    JSR SUB
+        ADD R5,R4,#-3
+        BRnp SKIP
+        LD R3,FIVE
+        ST R3,VAL
+SKIP    ADD R4,R4,#-1
+        BRp LOOP
+        HALT
+SUB     LD R1,VAL
+        ADD R1,R1,#1
+        RET
+VAL     .FILL #1
+FIVE    .FILL #5
+        .END
+''')
+    assert memo.hits > 0 and memo.invalidations > 0
+
+
+def test_nested_calls():
+    memo = assertSameRun('''
+        .ORIG x3000
+        AND R4,R4,#0
+        ADD R4,R4,#4
+LOOP    JSR OUTER
+        ADD R4,R4,#-1
+        BRp LOOP
+        HALT
+OUTER   ST R7,SAVE
+        JSR INNER
+        ADD R2,R1,R1
+        JSR INNER
+        ADD R2,R2,R1
+        LD R7,SAVE
+        RET
+INNER   LD R1,VAL
+        ADD R1,R1,#3
+        RET
+SAVE    .FILL #0
+VAL     .FILL #2
+        .END
+''')
+    assert memo.hits > 0
+
+
+def test_patched_code_is_not_replayed():
+    # The loop rewrites the subroutine's ADD immediate before every call
+    assertSameRun('''
+        .ORIG x3000
+        AND R4,R4,#0
+        ADD R4,R4,#4
+        LD R3,PATCH
+LOOP    ST R3,SUB
+        JSR SUB
+        ADD R3,R3,#1
+        ADD R4,R4,#-1
+        BRp LOOP
+        HALT
+SUB     ADD R1,R1,#0
+        RET
+PATCH   .FILL x1261
+        .END
+''')
+
+
+def test_self_modifying_call_is_not_replayed():
+    # The subroutine overwrites its own first instruction on every call
+    memo = assertSameRun('''
+        .ORIG x3000
+        AND R4,R4,#0
+        ADD R4,R4,#4
+LOOP    JSR SUB
+        ADD R4,R4,#-1
+        BRp LOOP
+        HALT
+SUB     ADD R1,R1,#1
+        LD R0,PATCH
+        ST R0,SUB
+        RET
+PATCH   .FILL x1262
+        .END
+''')
+    assert memo.inserts == 0
+
+
+def test_recursion():
+    with open(fibPath, 'r', encoding='utf-8') as sourceFile:
+        memo = assertSameRun(sourceFile.read(), '12\n')
+    assert memo.hits > 0
+
+
+def test_recursion_deeper_than_shadow_stack():
+    with open(fibPath, 'r', encoding='utf-8') as sourceFile:
+        assertSameRun(sourceFile.read(), '12\n', (256, 4, 32, 128, 3))
+
+
+def test_small_cache_evicts():
+    with open(fibPath, 'r', encoding='utf-8') as sourceFile:
+        memo = assertSameRun(sourceFile.read(), '12\n', (2, 2, 32, 16, 64))
+    assert memo.evictions > 0
+
+
+def test_replay_refused_by_cycle_limit_is_not_counted():
+    source = '''
+        .ORIG x3000
+        AND R4,R4,#0
+        ADD R4,R4,#5
+LOOP    JSR DOUBLE
+BACK    ADD R4,R4,#-1
+        BRp LOOP
+        HALT
+DOUBLE  LD R1,VAL
+        ADD R1,R1,R1
+        ADD R1,R1,R1
+        RET
+VAL     .FILL #7
+        .END
+'''
+    symbolTable = parseAssembly(source)[1]
+    stepped, returns = runProgram(source, maxCycles=0), 0
+    while not stepped.isHalted:
+        stepped.runFor(1)
+        returns += stepped.PC == symbolTable['BACK'] and stepped.IR == 0xC1C0
+        # Stopping anywhere, including inside a call too long to replay, must match plain execution
+        plain, memoized = runProgram(source, maxCycles=stepped.cycleCount), \
+            runProgram(source, memoArgs=(256, 4, 32, 128, 64), maxCycles=stepped.cycleCount)
+        assert (plain.memory == memoized.memory).all() and (plain.registers == memoized.registers).all()
+        assert (plain.PC, plain.PSR, plain.cycleCount) == (memoized.PC, memoized.PSR, memoized.cycleCount)
+        memo = memoized.memo
+        assert memo.hits == max(returns - 1, 0)
+        assert sum(memo.entryValid[i] and memo.entryPC[i] == symbolTable['DOUBLE'] for i in range(len(memo.entryValid))) <= 1
+    assert returns == 5
@@ -0,0 +1,55 @@
+import pytest
+
+from LC3VM_Service import LC3Service, runBatch, runJob
+
+
+def test_image_outside_memory_is_rejected():
+    for image in ([-1, 0xF025], [0xFFFF, 0xF025, 0xF025], [0x10000, 0xF025]):
+        with pytest.raises(ValueError):
+            runJob({'image': image}, 1000)
+
+
+def test_image_words_must_be_integers():
+    for image in ([True, 0xF025], [0x3000, False], [0x3000, 'x']):
+        with pytest.raises(ValueError):
+            runJob({'image': image}, 1000)
+
+
+def test_image_ending_at_last_address_runs():
+    result = runJob({'image': [0xFFFF, 0xF025]}, 1000)
+    assert result['halted'] and result['cycles'] == 1
+
+
+def test_cycle_limit_is_clamped_to_server_maximum():
+    # AND R0,R0,#0 then BRnzp to itself
+    result = runJob({'image': [0x3000, 0x5020, 0x0FFF], 'maxCycles': 10 ** 9}, 100)
+    assert result['cycles'] == 100 and not result['halted'] and not result['inputExhausted']
+
+
+def test_stdin_is_echoed():
+    result = runJob({'source': '''
+        .ORIG x3000
+        AND R1,R1,#0
+LOOP    GETC
+        OUT
+        BRz LOOP
+        .END
+''', 'stdin': 'hi'}, 1000)
+    assert result['output'] == 'hi'
+    assert result['halted'] and result['inputExhausted']
+
+
+def test_halt_does_not_report_exhausted_input():
+    result = runJob({'image': [0x3000, 0xF020, 0xF025], 'stdin': 'a'}, 1000)
+    assert result['halted'] and not result['inputExhausted'] and result['registers'][0] == ord('a')
+
+
+def test_batch_reports_errors_per_job():
+    results = runBatch([{'image': [-1]}, {'image': [0x3000, 0xF025]}], 1000)
+    assert 'error' in results[0] and results[1]['halted']
+
+
+def test_oversized_batch_is_rejected():
+    service = LC3Service(maxPending=2, autoStart=False)
+    code, body = service.submit([{'image': [0x3000, 0xF025]}] * 3)
+    assert code == 413 and 'error' in body